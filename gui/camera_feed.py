@@ -1,15 +1,53 @@
 import tkinter as tk
-import threading, queue, time, os
+import threading, queue, time, os, io, atexit
+from collections import deque
 from datetime import datetime
 from PIL import Image, ImageTk
 import cv2
+import numpy as np
 from pypylon import pylon
 
+# Optional GPU JPEG encoder (nvImageCodec / nvJPEG), used when SAVE_FORMAT is "jpg"
+try:
+    from nvidia import nvimgcodec
+except ImportError:
+    nvimgcodec = None
+
+# Optional chunked frame store (zarr>=3), used when SAVE_FORMAT is "zarr"
+try:
+    import zarr
+    from zarr.codecs import BloscCodec
+    from zarr.core.sync import sync as zarr_sync
+except ImportError:
+    zarr = None
+
 # UI refresh target (30 FPS)
 TARGET_UI_FPS = 30
+# Max preview size; frames are downscaled for display only
+PREVIEW_SIZE = (640, 480)
 # Desired image save rate (50 FPS)
 SAVE_RATE = 60.0
 TARGET_SAVE_INTERVAL = 1.0 / SAVE_RATE  # 10 ms
+# On-disk frame format: "png" (lossless, fast RLE), "npy" (header + raw pixels), "jpg",
+# or "zarr" (one Zstd-compressed (N, H, W) array instead of one file per frame)
+SAVE_FORMAT = "png"
+ZARR_INITIAL_FRAMES = 4096    # initial zarr length; doubled as needed, trimmed on stop
+ZARR_ATTRS_INTERVAL = 1.0     # s between n_frames checkpoints, in case the run never stops cleanly
+# Frames staged per batched encode call
+ENCODE_BATCH = 8
+JPEG_QUALITY = 85
+PNG_PARAMS = [cv2.IMWRITE_PNG_COMPRESSION, 1,
+              cv2.IMWRITE_PNG_STRATEGY, cv2.IMWRITE_PNG_STRATEGY_RLE]
+# Encode/save worker threads, and frames buffered for them before the oldest drop
+ENCODE_WORKERS = max(1, min(4, (os.cpu_count() or 2) // 2))
+SAVE_BUFFER_SIZE = 2 * ENCODE_BATCH
+# Frames pylon's grab thread can hold for the Python drain loop before the oldest drop
+GRAB_RING_SIZE = 4
+# Max encoded frames waiting for disk, and writes drained per writer wakeup
+WRITE_QUEUE_SIZE = 256
+WRITE_BATCH = 32
+# Max seconds to wait for buffered frames to flush when stopping
+SHUTDOWN_TIMEOUT = 30.0
 
 # === Base session path ===
 BASE_DIR = "/media/ben/Extreme SSD/particles_ML"
@@ -18,12 +56,183 @@ timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
 # Session folder (e.g. /media/ben/Extreme SSD/particles_ML/2025-10-06_21-15-32)
 RUN_DIR = os.path.join(BASE_DIR, timestamp)
 IMAGES_DIR = os.path.join(RUN_DIR, "images")
+FRAMES_ZARR = os.path.join(RUN_DIR, "frames.zarr")
 
 # Create both folders
 os.makedirs(IMAGES_DIR, exist_ok=True)
 
+# Per-frame path template, formatted with bytes % (cheaper than join + f-string at 60 FPS)
+FRAME_PATH_FMT = (os.fsencode(IMAGES_DIR).replace(b"%", b"%%")
+                  + b"/frame_%06d." + SAVE_FORMAT.encode())
+
 print(f"[save] Session folder: {RUN_DIR}")
-print(f"[save] Images will be saved to: {IMAGES_DIR}")
+print(f"[save] Images will be saved to: {FRAMES_ZARR if SAVE_FORMAT == 'zarr' else IMAGES_DIR}")
+
+class FrameBuffer:
+    """Bounded LIFO of frames awaiting encode; the oldest frame drops when full."""
+    def __init__(self, maxlen):
+        self.frames = deque(maxlen=maxlen)
+        self.cond = threading.Condition()
+        self.closed = False
+        self.dropped = 0
+
+    def put(self, item):
+        with self.cond:
+            if len(self.frames) == self.frames.maxlen:
+                self.dropped += 1
+            self.frames.append(item)
+            self.cond.notify()
+
+    def pop_batch(self, n):
+        """Block until frames are available; return up to n, newest first.
+        An empty list means the buffer was closed and fully drained."""
+        with self.cond:
+            while not self.frames and not self.closed:
+                self.cond.wait()
+            batch = []
+            while self.frames and len(batch) < n:
+                batch.append(self.frames.pop())
+            return batch
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+class WriterThread(threading.Thread):
+    """Writes (filename, data) tuples to disk off the grab thread.
+
+    data is one bytes-like object, or a tuple of them written back to back.
+    """
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.q = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+        self.err = None
+        self.written = 0
+
+    def run(self):
+        done = False
+        while not done:
+            batch = [self.q.get()]
+            # Drain whatever else is already queued so one wakeup covers many files
+            while len(batch) < WRITE_BATCH:
+                try:
+                    batch.append(self.q.get_nowait())
+                except queue.Empty:
+                    break
+
+            for item in batch:
+                if item is None:  # sentinel from stop()
+                    done = True
+                    continue
+                filename, data = item
+                try:
+                    with open(filename, "wb") as f:
+                        f.writelines(data if isinstance(data, tuple) else (data,))
+                    self.written += 1
+                except Exception as e:  # one bad item must not kill the writer
+                    self.err = str(e)
+
+    def stop(self, timeout=SHUTDOWN_TIMEOUT):
+        """Flush everything queued so far, then exit; gives up after timeout seconds."""
+        try:
+            self.q.put(None, timeout=timeout)
+        except queue.Full:
+            self.err = "writer stalled; frames still queued were not saved"
+            return
+        self.join(timeout)
+
+class EncodeWorker(threading.Thread):
+    """Pops the newest frames from a FrameBuffer, encodes them, feeds the writer.
+
+    With SAVE_FORMAT "zarr" frames go straight into `store` (set before
+    grabbing starts); zarr compresses each chunk itself.
+    """
+    def __init__(self, frames, writer):
+        super().__init__(daemon=True)
+        self.frames = frames
+        self.writer = writer
+        self.store = None
+        self.stored = 0
+        self.max_stored = -1  # highest frame index written to the zarr store
+        self.err = None
+        self.npy_headers = {}  # (shape, dtype) -> .npy header bytes
+        # One GPU encoder per worker; JPEG frames are encoded in batches
+        use_gpu = nvimgcodec is not None and SAVE_FORMAT == "jpg"
+        self.encoder = nvimgcodec.Encoder() if use_gpu else None
+        self.encode_params = (
+            nvimgcodec.EncodeParams(quality=JPEG_QUALITY) if use_gpu else None
+        )
+
+    def npy_header(self, frame):
+        key = (frame.shape, frame.dtype.str)
+        if key not in self.npy_headers:
+            buf = io.BytesIO()
+            np.lib.format.write_array_header_1_0(
+                buf, np.lib.format.header_data_from_array_1_0(frame))
+            self.npy_headers[key] = buf.getvalue()
+        return self.npy_headers[key]
+
+    def encode(self, frames):
+        if self.encoder is not None:
+            return self.encoder.encode(frames, "jpeg", params=self.encode_params)
+        if SAVE_FORMAT == "npy":
+            # Header is the same for every frame; the pixels go to the writer uncopied
+            return [(self.npy_header(frame), frame.data) for frame in frames]
+        if SAVE_FORMAT == "png":
+            return [cv2.imencode(".png", frame, PNG_PARAMS)[1].tobytes() for frame in frames]
+        return [
+            cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])[1].tobytes()
+            for frame in frames
+        ]
+
+    def run(self):
+        while True:
+            batch = self.frames.pop_batch(ENCODE_BATCH)
+            if not batch:
+                break
+            indices, frames = zip(*batch)
+            if self.store is not None:
+                for idx, frame in batch:
+                    try:
+                        self.store[idx] = frame  # one chunk per frame, so workers never collide
+                        self.stored += 1
+                        self.max_stored = max(self.max_stored, idx)
+                    except Exception as e:
+                        self.err = str(e)
+                continue
+            try:
+                encoded = self.encode(list(frames))
+            except Exception as e:
+                self.err = str(e)
+                continue
+            for idx, data in zip(indices, encoded):
+                if data is None:  # nvimgcodec returns None for frames it could not encode
+                    self.err = f"could not encode frame {idx}"
+                    continue
+                self.writer.q.put((FRAME_PATH_FMT % idx, data))
+
+class GrabHandler(pylon.ImageEventHandler):
+    """Runs on pylon's own grab thread: copies each frame into a small ring buffer."""
+    def __init__(self, maxlen):
+        super().__init__()
+        self.frames = deque(maxlen=maxlen)  # (capture_time, frame); append/popleft need no lock
+        self.ready = threading.Event()
+        self.dropped = 0  # frames evicted because the Python drain fell behind
+        self.err = None
+
+    def OnImageGrabbed(self, camera, grab):
+        try:
+            if grab.GrabSucceeded():
+                # Camera already delivers Mono8: view the grab buffer directly and take the
+                # one copy the UI and save pipeline share; pylon reuses the buffer afterwards
+                with grab.GetArrayZeroCopy() as view:
+                    if len(self.frames) == self.frames.maxlen:
+                        self.dropped += 1
+                    self.frames.append((time.time(), view.copy()))
+                self.ready.set()
+        except Exception as e:
+            self.err = str(e)
 
 class CameraGrabber(threading.Thread):
     def __init__(self, q, stop_event):
@@ -31,12 +240,82 @@ class CameraGrabber(threading.Thread):
         self.q = q
         self.stop_event = stop_event
         self.cam = None
-        self.converter = None
         self.err = None
         self.frame_index = 0
         self.last_save_time = 0
+        self.store = None
+        self.last_attrs_time = 0
+        self.handler = GrabHandler(GRAB_RING_SIZE)
+
+        # Grab loop -> FrameBuffer -> EncodeWorker pool -> WriterThread
+        self.frames = FrameBuffer(SAVE_BUFFER_SIZE)
+        self.writer = WriterThread()
+        self.workers = [EncodeWorker(self.frames, self.writer) for _ in range(ENCODE_WORKERS)]
+
+    @property
+    def save_error(self):
+        """First error reported by the save pipeline, if any."""
+        errs = [self.handler.err] + [w.err for w in self.workers] + [self.writer.err]
+        return next((e for e in errs if e), None)
+
+    @property
+    def dropped(self):
+        """Frames lost before saving: grab ring evictions plus save buffer evictions."""
+        return self.handler.dropped + self.frames.dropped
+
+    @property
+    def saved(self):
+        """Frames that have reached disk (files written or zarr chunks stored)."""
+        return self.writer.written + sum(w.stored for w in self.workers)
+
+    def _open_store(self):
+        """Create the (N, H, W) uint8 zarr array frames are written into."""
+        if zarr is None:
+            raise RuntimeError('SAVE_FORMAT "zarr" requires zarr>=3')
+        h, w = self.cam.Height.GetValue(), self.cam.Width.GetValue()
+        self.store = zarr.create_array(
+            FRAMES_ZARR, shape=(ZARR_INITIAL_FRAMES, h, w), chunks=(1, h, w), dtype="uint8",
+            compressors=BloscCodec(cname="zstd", clevel=3, shuffle="bitshuffle"),
+            fill_value=0, overwrite=True,
+        )
+        # No n_frames until the first checkpoint; readers then count the chunks on disk
+        self.store.attrs["complete"] = False
+        for worker in self.workers:
+            worker.store = self.store
+
+    def _resize_store(self, n_frames):
+        """Set the store's length to n_frames.
+
+        Chunks past frame_index were never written, so skip zarr's default pass that
+        lists and deletes every chunk outside the new shape.
+        """
+        zarr_sync(self.store._async_array.resize((n_frames, *self.store.shape[1:]),
+                                                 delete_outside_chunks=False))
+
+    def _checkpoint_store(self):
+        """Record how many frames the store holds so far, so readers never fall back to
+        the zero-padded length if the run is cut off."""
+        self.store.attrs["n_frames"] = max(w.max_stored for w in self.workers) + 1
+
+    def _dispatch(self, captured_at, frame):
+        # Push to UI queue (for display)
+        try:
+            self.q.put_nowait(frame)
+        except queue.Full:
+            pass
+
+        # --- Save frame at SAVE_RATE ---
+        if captured_at - self.last_save_time >= TARGET_SAVE_INTERVAL:
+            if self.store is not None and self.frame_index >= self.store.shape[0]:
+                self._resize_store(2 * self.store.shape[0])  # grows before any worker needs it
+            self.frames.put((self.frame_index, frame))
+            self.last_save_time = captured_at
+            self.frame_index += 1
 
     def run(self):
+        self.writer.start()
+        for w in self.workers:
+            w.start()
         try:
             tl = pylon.TlFactory.GetInstance()
             devs = tl.EnumerateDevices()
@@ -52,44 +331,76 @@ class CameraGrabber(threading.Thread):
             self.cam.Gain.SetValue(25.0)
             self.cam.PixelFormat.SetValue("Mono8")
 
-            self.converter = pylon.ImageFormatConverter()
-            self.converter.OutputPixelFormat = pylon.PixelType_Mono8
-            self.converter.OutputBitAlignment = pylon.OutputBitAlignment_MsbAligned
+            if SAVE_FORMAT == "zarr":
+                self._open_store()
 
-            self.cam.StartGrabbing(pylon.GrabStrategy_LatestImageOnly)
+            # pylon's native grab loop delivers frames to the handler; this thread only drains
+            self.cam.RegisterImageEventHandler(self.handler, pylon.RegistrationMode_ReplaceAll,
+                                               pylon.Cleanup_None)
+            self.cam.StartGrabbing(pylon.GrabStrategy_OneByOne,
+                                   pylon.GrabLoop_ProvidedByInstantCamera)
 
             while not self.stop_event.is_set() and self.cam.IsGrabbing():
-                grab = self.cam.RetrieveResult(5000, pylon.TimeoutHandling_ThrowException)
-                if grab.GrabSucceeded():
-                    frame = self.converter.Convert(grab).GetArray()
-
-                    # Push to UI queue (for display)
-                    try:
-                        self.q.put_nowait(frame)
-                    except queue.Full:
-                        pass
-
-                    # --- Save frame at 100 FPS ---
-                    now = time.time()
-                    if now - self.last_save_time >= TARGET_SAVE_INTERVAL:
-                        filename = os.path.join(IMAGES_DIR, f"frame_{self.frame_index:06d}.jpg")
-                        cv2.imwrite(filename, frame)
-                        self.last_save_time = now
-                        self.frame_index += 1
-
-                grab.Release()
+                if not self.handler.ready.wait(timeout=0.5):
+                    continue
+                self.handler.ready.clear()
+                while self.handler.frames:
+                    self._dispatch(*self.handler.frames.popleft())
+                now = time.time()
+                if self.store is not None and now - self.last_attrs_time >= ZARR_ATTRS_INTERVAL:
+                    self._checkpoint_store()
+                    self.last_attrs_time = now
 
         except Exception as e:
             self.err = str(e)
 
         finally:
+            # Stop pylon's grab thread first so it stops copying frames while we flush
             try:
                 if self.cam:
                     self.cam.StopGrabbing()
+                    self.cam.DeregisterImageEventHandler(self.handler)
                     self.cam.Close()
             except Exception:
                 pass
             print("[camera] Stopped grabbing.")
+            try:
+                while self.handler.frames:  # frames grabbed before the stop still get saved
+                    self._dispatch(*self.handler.frames.popleft())
+            except Exception as e:
+                self.err = str(e)
+
+            # Let the workers drain what is buffered, then flush the writer
+            deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+            self.frames.close()
+            for w in self.workers:
+                w.join(max(0.0, deadline - time.monotonic()))
+            self.writer.stop(max(0.0, deadline - time.monotonic()))
+            if self.store is not None:
+                # Trim the spare length; unwritten (dropped) frames read back as zeros
+                try:
+                    self._resize_store(self.frame_index)
+                    self.store.attrs.update({"n_frames": self.frame_index, "complete": True})
+                except Exception as e:
+                    self.err = str(e)
+
+# Grabbers started by this process; joined at exit so buffered frames reach disk
+_grabbers = []
+
+def _stop_grabbers():
+    """Stop every grabber and wait for its save pipeline to flush."""
+    for grabber in _grabbers:
+        grabber.stop_event.set()
+    for grabber in _grabbers:
+        if grabber.is_alive():
+            print("[save] Flushing buffered frames before exit…")
+            # The grabber bounds its own flush; the slack covers closing the camera
+            grabber.join(SHUTDOWN_TIMEOUT + 5.0)
+            if grabber.is_alive():
+                print("[save] Flush timed out; some buffered frames were not saved")
+
+# Runs on sys.exit (e.g. motor_controls.on_close) while the daemon threads are still alive
+atexit.register(_stop_grabbers)
 
 def _build_camera_window(parent):
     top = tk.Toplevel(parent)
@@ -102,6 +413,7 @@ def _build_camera_window(parent):
     q = queue.Queue(maxsize=2)
     stop_event = threading.Event()
     grabber = CameraGrabber(q, stop_event)
+    _grabbers.append(grabber)
     grabber.start()
     tk_image = None
 
@@ -115,15 +427,16 @@ def _build_camera_window(parent):
             pass
 
         if frame is not None:
-            rgb = cv2.cvtColor(frame, cv2.COLOR_GRAY2RGB)
-            img = Image.fromarray(rgb)
+            img = Image.fromarray(frame)  # Mono8 ndarray -> 'L' image, no RGB expansion
+            img.thumbnail(PREVIEW_SIZE, Image.NEAREST)
             tk_image = ImageTk.PhotoImage(img)
             label.config(image=tk_image)
 
-        if grabber.err:
-            info.config(text=f"[!] {grabber.err}")
+        if grabber.err or grabber.save_error:
+            info.config(text=f"[!] {grabber.err or grabber.save_error}")
         else:
-            info.config(text=f"Streaming… {grabber.frame_index} frames saved")
+            info.config(text=f"Streaming… {grabber.saved} frames saved, "
+                             f"{grabber.dropped} dropped")
 
         top.after(int(1000 / TARGET_UI_FPS), update_ui)
 
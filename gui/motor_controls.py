@@ -1,31 +1,100 @@
 import tkinter as tk
-import serial, time, sys
+import serial, time, sys, threading, queue
 
 # ===== Config =====
 SERIAL_PORT = "/dev/ttyACM0"
 BAUD = 115200
 STEPS_PER_REV = 6400  # adjust if microstepping
+TX_QUEUE_SIZE = 64    # pending serial commands before new ones are dropped
+TX_PUT_TIMEOUT = 0.5  # s the GUI waits for queue space before giving up on a command
+WRITE_TIMEOUT = 1.0   # s a single ser.write may block before raising SerialTimeoutException
 
 # ===== Serial Setup =====
 try:
-    ser = serial.Serial(SERIAL_PORT, BAUD, timeout=1)
+    ser = serial.Serial(SERIAL_PORT, BAUD, timeout=1, write_timeout=WRITE_TIMEOUT)
     time.sleep(2)
     print(f"[i] Serial connected on {SERIAL_PORT} @ {BAUD}")
 except serial.SerialException as e:
     print(f"[!] Serial error: {e}")
     ser = None
 
+# ===== Serial writer thread (keeps ser.write off the Tk loop) =====
+_tx_q = queue.Queue(maxsize=TX_QUEUE_SIZE)
+
+def _coalesce(batch):
+    """Collapse runs of back-to-back S### commands to the newest speed."""
+    out = []
+    for msg in batch:
+        if out and msg.startswith(b"S") and out[-1].startswith(b"S"):
+            out[-1] = msg
+        else:
+            out.append(msg)
+    return out
+
+def _evict_queued_speed():
+    """Remove the oldest queued S### (superseded by anything newer); True if one was removed."""
+    with _tx_q.mutex:
+        for i, msg in enumerate(_tx_q.queue):
+            if msg is not None and msg.startswith(b"S"):
+                del _tx_q.queue[i]
+                _tx_q.not_full.notify()
+                return True
+    return False
+
+def _tx_worker():
+    while True:
+        batch = [_tx_q.get()]
+        while True:
+            try:
+                batch.append(_tx_q.get_nowait())
+            except queue.Empty:
+                break
+        stop = None in batch  # sentinel from _stop_tx()
+        if stop:
+            batch = batch[:batch.index(None)]
+        for msg in _coalesce(batch):
+            try:
+                ser.write(msg)
+            except Exception as e:
+                print(f"[!] Serial write failed: {e}")
+        if stop:
+            return
+
+_tx_thread = threading.Thread(target=_tx_worker, daemon=True)
+if ser:
+    _tx_thread.start()
+
+def _stop_tx():
+    """Write out everything already queued, then stop the writer thread."""
+    if _tx_thread.is_alive():
+        try:
+            _tx_q.put(None, timeout=2)
+        except queue.Full:
+            print("[!] Serial writer stalled; closing without flushing queued commands.")
+            return
+        _tx_thread.join(timeout=2)
+
 # ===== Helper: send command =====
 def send_command(cmd, val=None):
-    """Send simple serial command like S###, X, T, etc."""
+    """Queue simple serial command like S###, X, T, etc."""
     if not ser:
         print("[!] Serial not connected.")
         return
     msg = f"{cmd}{val if val is not None else ''}\n".encode()
     try:
-        ser.write(msg)
-    except Exception as e:
-        print(f"[!] Serial write failed: {e}")
+        _tx_q.put_nowait(msg)
+        return
+    except queue.Full:
+        pass
+    # Queue is full (serial stalled): make room by evicting a stale speed command.
+    # Stop/reverse/home are never dropped for lack of space; they wait briefly instead.
+    if _evict_queued_speed() or not msg.startswith(b"S"):
+        try:
+            _tx_q.put(msg, timeout=TX_PUT_TIMEOUT)
+            return
+        except queue.Full:
+            pass
+    print(f"[!] Serial queue full, dropped {msg!r}")
 
 # ===== GUI root =====
 root = tk.Tk()
@@ -115,6 +184,7 @@ def on_close():
         stop_motor()
     except Exception:
         pass
+    _stop_tx()
     try:
         if ser and ser.is_open:
             ser.close()
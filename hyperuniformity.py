@@ -1,32 +1,51 @@
 #!/usr/bin/env python3
 """
-Batch hyperuniformity analyzer for JPG images.
+Batch hyperuniformity analyzer for particle images (.jpg/.png/.npy).
 
 - Selects a circular ROI (Region of Interest) once.
-- Computes isotropic structure factor S(k) for all .jpgs in the folder.
+- Computes isotropic structure factor S(k) for all .jpg/.jpeg/.png/.npy frames in the folder.
 - Averages S(k) across images.
 - Fits low-k region (S(k) ~ k^alpha) to get hyperuniformity exponent.
 
 Requires:
   pip install numpy matplotlib scipy scikit-image
+Optional (faster FFT with a reusable plan, compiled radial binning):
+  pip install pyfftw numba
 """
 
 import os
 import numpy as np
 import matplotlib.pyplot as plt
 from skimage.io import imread
-from scipy.fft import fft2, fftshift
+from scipy.fft import rfft2, fftfreq
 from scipy.ndimage import uniform_filter1d
 from scipy.stats import linregress
 from matplotlib.widgets import EllipseSelector
 import json
 
+try:
+    import pyfftw
+    import pyfftw.builders
+except ImportError:
+    pyfftw = None
+
+try:
+    from numba import njit, prange, get_num_threads
+except ImportError:
+    njit = None
+
 # ---------------- Config ----------------
 ROI_FILE = "roi.json"
-EXTS = (".jpg", ".jpeg", ".png")
+EXTS = (".jpg", ".jpeg", ".png", ".npy")
 LOW_K_FIT_FRAC = 0.1  # fit first 10% of k-values
 # ----------------------------------------
 
+def load_gray(path):
+    """Read an image as grayscale; .npy frames from the camera GUI are raw arrays."""
+    if path.lower().endswith(".npy"):
+        return np.load(path)
+    return imread(path, as_gray=True)
+
 def select_circular_roi(img):
     """Interactive ROI selection: click once for center, once for edge."""
     pts = []
@@ -63,20 +82,75 @@ def load_or_select_roi(img):
     else:
         return select_circular_roi(img)
 
-def apply_circular_mask(img, cx, cy, r):
-    Y, X = np.ogrid[:img.shape[0], :img.shape[1]]
-    mask = (X - cx)**2 + (Y - cy)**2 <= r**2
-    return np.where(mask, img, 0)
-
-def compute_structure_factor(img):
-    F = fftshift(fft2(img - np.mean(img)))
-    S = np.abs(F)**2
-    ny, nx = S.shape
-    y, x = np.indices(S.shape)
-    cx, cy = nx//2, ny//2
-    r = np.sqrt((x - cx)**2 + (y - cy)**2).astype(int)
-    tbin = np.bincount(r.ravel(), S.ravel())
-    nr = np.bincount(r.ravel())
+def build_mask(shape, cx, cy, r):
+    """Boolean mask, True inside the circular ROI; built once per batch."""
+    Y, X = np.ogrid[:shape[0], :shape[1]]
+    return (X - cx)**2 + (Y - cy)**2 <= r**2
+
+def build_radial_index(shape):
+    """Precompute integer |k| bins for the rfft2 half-plane of an image of `shape`.
+
+    rfft2 keeps only kx >= 0; every column with a mirrored -kx partner in the
+    full spectrum is weighted 2 so the bins match the full fftshift'd spectrum.
+    Returns (r_flat, w_flat, nr): bin per element, element weight, bin counts.
+    """
+    ny, nx = shape
+    ky = np.rint(fftfreq(ny) * ny)
+    kx = np.arange(nx // 2 + 1)
+    r = np.sqrt(kx[None, :]**2 + ky[:, None]**2).astype(int)
+
+    w = np.full(kx.shape, 2.0)
+    w[0] = 1.0
+    if nx % 2 == 0:
+        w[-1] = 1.0  # Nyquist column has no mirrored partner
+    w = np.broadcast_to(w, r.shape)
+
+    r_flat = r.ravel()
+    w_flat = w.ravel()
+    nr = np.bincount(r_flat, w_flat)
+    return r_flat, w_flat, nr
+
+if njit is not None:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def radial_sum(r_flat, w_flat, S_flat, n_bins):
+        """Weighted sum of S per |k| bin in one pass; each thread owns a partial row."""
+        n_threads = get_num_threads()
+        partial = np.zeros((n_threads, n_bins))
+        chunk = (S_flat.size + n_threads - 1) // n_threads
+        for t in prange(n_threads):
+            for i in range(t * chunk, min((t + 1) * chunk, S_flat.size)):
+                partial[t, r_flat[i]] += w_flat[i] * S_flat[i]
+        tbin = np.zeros(n_bins)
+        for t in range(n_threads):
+            tbin += partial[t]
+        return tbin
+else:
+    def radial_sum(r_flat, w_flat, S_flat, n_bins):
+        """Weighted sum of S per |k| bin."""
+        return np.bincount(r_flat, S_flat * w_flat, minlength=n_bins)
+
+def build_fft(shape):
+    """Return (in_buf, fft) for repeated float32 rfft2 of images of `shape`.
+
+    Fill in_buf, then call fft(). With pyfftw the FFTW_MEASURE plan is made
+    once and reused; otherwise scipy.fft runs on the same buffer.
+    """
+    threads = os.cpu_count() or 1
+    if pyfftw is not None:
+        in_buf = pyfftw.empty_aligned(shape, dtype="float32")
+        fft = pyfftw.builders.rfft2(in_buf, threads=threads, planner_effort="FFTW_MEASURE",
+                                    auto_align_input=True, avoid_copy=True)
+        return in_buf, fft
+    in_buf = np.empty(shape, dtype=np.float32)
+    return in_buf, lambda: rfft2(in_buf, workers=threads)
+
+def compute_structure_factor(img, mask, radial_index, fft_plan):
+    r_flat, w_flat, nr = radial_index
+    in_buf, fft = fft_plan
+    np.multiply(img, mask, out=in_buf)  # mask and copy into the FFT input in one pass
+    in_buf -= in_buf.mean()
+    S = np.abs(fft())**2
+    tbin = radial_sum(r_flat, w_flat, S.ravel(), len(nr))
     radial_S = tbin / np.maximum(nr, 1)
     k = np.arange(len(radial_S))
     return k, radial_S / np.max(radial_S)
@@ -97,18 +171,23 @@ def main(folder):
         return
 
     print(f"[INFO] Found {len(imgs)} images.")
-    first = imread(imgs[0], as_gray=True)
+    first = load_gray(imgs[0])
     roi = load_or_select_roi(first)
 
-    all_S = []
+    # Every frame shares the first one's shape, so the mask, |k| bins and FFT plan are built once
+    mask = build_mask(first.shape[:2], **roi)
+    radial_index = build_radial_index(first.shape[:2])
+    fft_plan = build_fft(first.shape[:2])
+
+    # Stream the mean: only the running sum of S(k) is kept, not every image's S(k)
+    S_sum = np.zeros(len(radial_index[2]), dtype=np.float64)
     for i, path in enumerate(imgs):
-        img = imread(path, as_gray=True).astype(float)
-        masked = apply_circular_mask(img, **roi)
-        k, S = compute_structure_factor(masked)
-        all_S.append(S)
+        img = load_gray(path)
+        k, S = compute_structure_factor(img, mask, radial_index, fft_plan)
+        S_sum += S
         print(f"[{i+1}/{len(imgs)}] Processed {os.path.basename(path)}")
 
-    S_mean = np.mean(all_S, axis=0)
+    S_mean = S_sum / len(imgs)
     S_smooth = uniform_filter1d(S_mean, size=5)
     alpha, intercept, r2 = fit_low_k_powerlaw(k, S_smooth)
 
@@ -124,5 +203,5 @@ def main(folder):
     plt.show()
 
 if __name__ == "__main__":
-    folder = input("Enter folder path containing JPGs: ").strip()
+    folder = input("Enter folder path containing images: ").strip()
     main(folder)
@@ -3,11 +3,12 @@
 Batch Trackpy particle detection with circular ROI
 - Base directory: /media/ben/Extreme SSD/particles_ML/
 - Usage: python3 track_particles_batch.py <timestamp_folder_name>
-- Looks for images in: BASE_DIR/<timestamp>/images/
-- Saves located_particles.csv in BASE_DIR/<timestamp>/
+- Looks for frames in: BASE_DIR/<timestamp>/frames.zarr, else BASE_DIR/<timestamp>/images/
+- Saves located_particles.parquet in BASE_DIR/<timestamp>/
 """
 
-import os, json, sys, glob
+import os, re, json, sys, glob, threading
+import multiprocessing as mp
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
@@ -15,14 +16,62 @@ from matplotlib.patches import Circle
 import trackpy as tp
 from skimage.io import imread
 
+# Optional GPU batch decoder (nvImageCodec / nvJPEG) for JPEG runs; falls back to skimage imread
+try:
+    from nvidia import nvimgcodec
+except ImportError:
+    nvimgcodec = None
+
+# Optional chunked frame store written by gui/camera_feed.py (SAVE_FORMAT "zarr", zarr>=3)
+try:
+    import zarr
+except ImportError:
+    zarr = None
+
 # --- Config ---
 BASE_DIR = "/media/ben/Extreme SSD/particles_ML"
 ROI_FILE = "roi.json"
 DIAMETER = 9
 MINMASS = 500
 INVERT = False
+BATCH_SIZE = 32  # frames decoded together and handed to a worker process at a time
+GPU_DECODE_EXTS = (".jpg",)  # only nvJPEG is GPU-accelerated; PNG would decode on the CPU anyway
+MAX_GPU_BATCHES_IN_FLIGHT = 4  # decoded batches queued for the pool before decoding waits
+FRAME_EXTS = (".png", ".npy", ".jpg")  # formats written by gui/camera_feed.py
+FRAMES_ZARR = "frames.zarr"
+FRAME_NAME_RE = re.compile(r"frame_(\d+)\.")  # frame_000123.png -> 123
 # ---------------
 
+def frame_number(path):
+    """Capture index encoded in a camera_feed filename; dropped frames leave gaps."""
+    return int(FRAME_NAME_RE.match(os.path.basename(path)).group(1))
+
+
+def load_frame(path):
+    """Read one saved frame; .npy frames are raw arrays, everything else is decoded."""
+    if path.lower().endswith(".npy"):
+        return np.load(path)
+    return imread(path)
+
+
+def load_frames(paths, decoder=None):
+    """Read a batch of frames, decoding image files in a single GPU call if possible."""
+    frames = [None] * len(paths)
+    to_decode = [j for j, p in enumerate(paths) if not p.lower().endswith(".npy")]
+    if decoder is not None and to_decode:
+        # Frames are Mono8: decode to one channel instead of the default interleaved RGB
+        params = nvimgcodec.DecodeParams(color_spec=nvimgcodec.ColorSpec.GRAY)
+        decoded = decoder.read([paths[j] for j in to_decode], params=params)
+        for j, im in zip(to_decode, decoded):
+            if im is not None:
+                img = np.asarray(im.cpu())
+                frames[j] = img[:, :, 0] if img.ndim == 3 else img  # H×W×1 -> H×W uint8
+    for j, p in enumerate(paths):
+        if frames[j] is None:
+            frames[j] = load_frame(p)
+    return frames
+
+
 def load_or_define_roi(sample_img):
     """Load roi.json if exists, otherwise let user click center and edge."""
     if os.path.exists(ROI_FILE):
@@ -56,51 +105,147 @@ def load_or_define_roi(sample_img):
     return roi
 
 
-def apply_circular_mask(img, roi):
-    """Apply circular mask to image."""
-    cx, cy, r = roi["cx"], roi["cy"], roi["r"]
-    Y, X = np.ogrid[:img.shape[0], :img.shape[1]]
-    mask = (X - cx)**2 + (Y - cy)**2 > r**2
-    result = img.copy()
-    result[mask] = 0
-    return result
+def build_mask(shape, cx, cy, r):
+    """Boolean mask, True inside the circular ROI."""
+    Y, X = np.ogrid[:shape[0], :shape[1]]
+    return (X - cx)**2 + (Y - cy)**2 <= r**2
 
 
-def process_image_sequence(timestamp):
-    run_dir = os.path.join(BASE_DIR, timestamp)
-    images_dir = os.path.join(run_dir, "images")
+_MASK = None     # per-worker uint8 ROI mask, set by _init_worker
+_FRAMES = None   # per-worker read-only zarr frame array, if the run was saved as zarr
 
-    if not os.path.exists(images_dir):
-        print(f"[!] Could not find image directory: {images_dir}")
-        sys.exit(1)
 
-    images = sorted(glob.glob(os.path.join(images_dir, "*.jpg")))
-    if not images:
-        print(f"[!] No images found in {images_dir}")
-        sys.exit(1)
+def _init_worker(mask_u8, zarr_path=None):
+    global _MASK, _FRAMES
+    _MASK = mask_u8
+    if zarr_path:
+        _FRAMES = zarr.open(zarr_path, mode="r")
 
-    print(f"[i] Found {len(images)} images in {images_dir}")
-    sample_img = imread(images[0])
-    roi = load_or_define_roi(sample_img)
 
-    out_csv = os.path.join(run_dir, "located_particles.csv")
-    all_frames = []
+def _gpu_decoded(tasks, decoder, in_flight):
+    """Parent side: decode each task batch on the GPU and yield it with its arrays.
+
+    Runs in the pool's task-feeder thread; `in_flight` stops it from decoding the
+    whole run into memory ahead of the workers.
+    """
+    for batch in tasks:
+        in_flight.acquire()
+        indices, paths = zip(*batch)
+        yield list(zip(indices, paths, load_frames(paths, decoder)))
 
-    for i, path in enumerate(images):
-        img = imread(path)
+
+def _locate_batch(batch):
+    """Worker: load a batch of (frame, path[, decoded]), then mask and locate each frame."""
+    indices = [item[0] for item in batch]
+    paths = [item[1] for item in batch]
+    if len(batch[0]) == 3:
+        frames = [item[2] for item in batch]  # already decoded by the parent's GPU decoder
+    elif _FRAMES is not None:
+        frames = [_FRAMES[i] for i in indices]  # Zstd chunk decode only, no image codec
+    else:
+        frames = load_frames(paths)
+    results = []
+    for i, path, img in zip(indices, paths, frames):
         if img.ndim == 3:
             img = np.mean(img, axis=2).astype(np.uint8)
-        masked = apply_circular_mask(img, roi)
-        f = tp.locate(masked, DIAMETER, minmass=MINMASS, invert=INVERT)
+        elif not img.flags.writeable:
+            img = img.copy()
+        img *= _MASK  # zero pixels outside the ROI in place
+        f = tp.locate(img, DIAMETER, minmass=MINMASS, invert=INVERT)
         f["frame"] = i
         f["filename"] = os.path.basename(path)
-        all_frames.append(f)
+        results.append(f)
+    return results
+
+
+def process_image_sequence(timestamp):
+    run_dir = os.path.join(BASE_DIR, timestamp)
+    images_dir = os.path.join(run_dir, "images")
+    zarr_path = os.path.join(run_dir, FRAMES_ZARR)
+
+    if os.path.exists(zarr_path):
+        if zarr is None:
+            print(f"[!] {zarr_path} needs zarr>=3 to read")
+            sys.exit(1)
+        frames = zarr.open(zarr_path, mode="r")
+        n_frames = frames.attrs.get("n_frames")
+        complete = frames.attrs.get("complete", True)
+        if n_frames is None or (not n_frames and not complete):
+            # No checkpoint yet; never guess from shape[0], an untrimmed store is zero-padded
+            print(f"[!] {zarr_path} has no n_frames checkpoint; "
+                  f"using the {frames.nchunks_initialized} frames actually written")
+            n_frames = frames.nchunks_initialized
+        elif not complete:
+            print(f"[!] Recording in {zarr_path} did not finish cleanly; "
+                  f"using the last checkpoint ({n_frames} frames)")
+        n_frames = min(n_frames, frames.shape[0])
+        if not n_frames:
+            print(f"[!] No frames found in {zarr_path}")
+            sys.exit(1)
+        # Labels for the 'filename' column; workers read frames by index
+        images = [f"{FRAMES_ZARR}[{i}]" for i in range(n_frames)]
+        indexed = list(enumerate(images))
+        print(f"[i] Found {n_frames} frames in {zarr_path}")
+        sample_img = frames[0]
+    else:
+        zarr_path = None
+        if not os.path.exists(images_dir):
+            print(f"[!] Could not find image directory: {images_dir}")
+            sys.exit(1)
+
+        # Sort numerically: %06d stops being zero-padded past frame 999999
+        images = sorted((p for p in glob.glob(os.path.join(images_dir, "frame_*"))
+                         if p.lower().endswith(FRAME_EXTS)
+                         and FRAME_NAME_RE.match(os.path.basename(p))),
+                        key=frame_number)
+        if not images:
+            print(f"[!] No images found in {images_dir}")
+            sys.exit(1)
+
+        # Number frames by capture index, not list position, so time keeps its gaps
+        indexed = [(frame_number(p), p) for p in images]
+        missing = indexed[-1][0] + 1 - len(indexed)
+        print(f"[i] Found {len(images)} images in {images_dir}"
+              + (f" ({missing} frames dropped while recording)" if missing else ""))
+        sample_img = load_frame(images[0])
+    roi = load_or_define_roi(sample_img)
 
-        print(f"[{i+1}/{len(images)}] Found {len(f)} particles in {os.path.basename(path)}")
+    out_path = os.path.join(run_dir, "located_particles.parquet")
+    # Constant ROI: build the mask once and ship it to each worker at startup
+    mask_u8 = build_mask(sample_img.shape[:2], roi["cx"], roi["cy"], roi["r"]).astype(np.uint8)
 
+    all_frames = []
+    tasks = [indexed[j:j + BATCH_SIZE] for j in range(0, len(indexed), BATCH_SIZE)]
+    n_tasks = len(tasks)
+
+    # One GPU decoder for the whole run, in this process, and only for JPEG frames;
+    # the pool workers stay CPU-only instead of each opening its own CUDA context
+    use_gpu = (nvimgcodec is not None and zarr_path is None
+               and all(p.lower().endswith(GPU_DECODE_EXTS) for p in images))
+
+    with mp.Pool(os.cpu_count(), initializer=_init_worker, initargs=(mask_u8, zarr_path)) as pool:
+        in_flight = None
+        if use_gpu:
+            # Created after the workers fork so none of them inherits CUDA state
+            in_flight = threading.Semaphore(MAX_GPU_BATCHES_IN_FLIGHT)
+            tasks = _gpu_decoded(tasks, nvimgcodec.Decoder(), in_flight)
+        try:
+            for results in pool.imap_unordered(_locate_batch, tasks):
+                if in_flight is not None:
+                    in_flight.release()
+                all_frames.extend(results)
+                print(f"[{len(all_frames)}/{len(images)}] frames located")
+        finally:
+            if in_flight is not None:
+                # Unblock the feeder thread if we bailed out early, so pool shutdown can't hang
+                for _ in range(n_tasks):
+                    in_flight.release()
+
+    # imap_unordered returns frames as they finish; restore frame order
     df = pd.concat(all_frames, ignore_index=True)
-    df.to_csv(out_csv, index=False)
-    print(f"[✓] Saved all detections → {out_csv}")
+    df = df.sort_values("frame", kind="stable", ignore_index=True)
+    df.to_parquet(out_path, engine="pyarrow", compression="zstd", compression_level=3, index=False)
+    print(f"[✓] Saved all detections → {out_path}")
 
 
 if __name__ == "__main__":
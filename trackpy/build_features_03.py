@@ -2,13 +2,13 @@
 """
 build_features.py
 -----------------
-Loads linked trajectories, computes per-particle features, and saves summary CSVs.
+Loads linked trajectories, computes per-particle features, and saves a summary table.
 
 Expected input:
-    /media/ben/Extreme SSD/particles_ML/<timestamp>/linked_trajectories.csv
+    /media/ben/Extreme SSD/particles_ML/<timestamp>/linked_trajectories.parquet
 
 Outputs:
-    trajectory_features.csv (aggregated stats)
+    trajectory_features.parquet (aggregated stats)
     trajectory_features.png  (optional visualization)
 """
 
@@ -25,23 +25,27 @@ RUN_FOLDER = max(
      if os.path.isdir(os.path.join(BASE_DIR, d))],
     key=os.path.getmtime
 )
-LINKED_FILE = os.path.join(RUN_FOLDER, "linked_trajectories.csv")
-OUT_FILE = os.path.join(RUN_FOLDER, "trajectory_features.csv")
+LINKED_FILE = os.path.join(RUN_FOLDER, "linked_trajectories.parquet")
+OUT_FILE = os.path.join(RUN_FOLDER, "trajectory_features.parquet")
 
 MIN_TRACK_LEN = 5       # ignore shorter tracks
 N_PLOT = 1000            # number of random tracks to plot
 SHOW_PLOTS = True
+# Compact column types: halves the working set of the groupby and plotting
+DTYPES = {"x": "float32", "y": "float32", "frame": "int32", "particle": "int32",
+          "mass": "float32", "ecc": "float32"}
 # ====================
 
 
 def main():
     print(f"[i] Loading linked trajectories from {LINKED_FILE}")
-    df = pd.read_csv(LINKED_FILE)
+    df = pd.read_parquet(LINKED_FILE)
+    df = df.astype({c: t for c, t in DTYPES.items() if c in df.columns})
     print(f"[i] Loaded {len(df)} rows")
 
     # --- Verify essential columns ---
     if not {"x", "y", "frame", "particle"}.issubset(df.columns):
-        raise ValueError("Input CSV must contain columns: x, y, frame, particle")
+        raise ValueError("Input table must contain columns: x, y, frame, particle")
 
     # --- Remove very short tracks ---
     track_lens = df.groupby("particle")["frame"].count()
@@ -49,29 +53,37 @@ def main():
     df = df[df["particle"].isin(long_particles)]
     print(f"[✓] Retained {len(df)} points from {len(long_particles)} tracks (len ≥ {MIN_TRACK_LEN})")
 
-    # --- Compute per-particle feature summary ---
-    features = []
-    for pid, g in df.groupby("particle"):
-        g = g.sort_values("frame")
-        dx = np.gradient(g["x"])
-        dy = np.gradient(g["y"])
-        speeds = np.sqrt(dx**2 + dy**2)
-        turns = np.arctan2(np.gradient(dy), np.gradient(dx))
-
-        features.append({
-            "particle": pid,
-            "n_frames": len(g),
-            "duration": g["frame"].max() - g["frame"].min(),
-            "speed_mean": np.mean(speeds),
-            "speed_std": np.std(speeds),
-            "turn_mean": np.mean(turns),
-            "turn_std": np.std(turns),
-            "mass_mean": g["mass"].mean() if "mass" in g.columns else np.nan,
-            "ecc_mean": g["ecc"].mean() if "ecc" in g.columns else np.nan,
-        })
-
-    feats = pd.DataFrame(features)
-    feats.to_csv(OUT_FILE, index=False)
+    # --- Compute per-particle feature summary (vectorized over all tracks) ---
+    df = df.sort_values(["particle", "frame"])
+    pid = df["particle"].to_numpy()
+    dx = np.diff(df["x"].to_numpy())
+    dy = np.diff(df["y"].to_numpy())
+    # Forward differences over the whole table; steps that cross into the next track are NaN
+    same = pid[1:] == pid[:-1]
+    speed = np.full(len(df), np.nan)
+    speed[1:] = np.where(same, np.hypot(dx, dy), np.nan)
+    turn = np.full(len(df), np.nan)
+    turn[2:] = np.where(same[1:] & same[:-1], np.arctan2(np.diff(dy), np.diff(dx)), np.nan)
+    df = df.assign(speed=speed, turn=turn)
+
+    grouped = df.groupby("particle")
+    feats = grouped.agg(
+        n_frames=("frame", "size"),
+        frame_min=("frame", "min"),
+        frame_max=("frame", "max"),
+        speed_mean=("speed", "mean"),
+        turn_mean=("turn", "mean"),
+    )
+    feats["duration"] = feats.pop("frame_max") - feats.pop("frame_min")
+    feats["speed_std"] = grouped["speed"].std(ddof=0)
+    feats["turn_std"] = grouped["turn"].std(ddof=0)
+    feats["mass_mean"] = grouped["mass"].mean() if "mass" in df.columns else np.nan
+    feats["ecc_mean"] = grouped["ecc"].mean() if "ecc" in df.columns else np.nan
+    feats = feats.reset_index()[[
+        "particle", "n_frames", "duration", "speed_mean", "speed_std",
+        "turn_mean", "turn_std", "mass_mean", "ecc_mean",
+    ]]
+    feats.to_parquet(OUT_FILE, engine="pyarrow", compression="zstd", compression_level=3, index=False)
     print(f"[✓] Saved feature table → {OUT_FILE}")
     print(feats.describe())
 
@@ -87,9 +99,12 @@ def main():
         else:
             subset_ids = np.random.choice(unique_particles, size=min(N_PLOT, len(unique_particles)), replace=False)
 
+        # Split only the sampled tracks, once, instead of scanning the table per track
+        sampled = df[df['particle'].isin(subset_ids)]
+        groups = dict(list(sampled.groupby('particle', sort=False)))
         for pid in subset_ids:
-            g = df[df['particle'] == pid]
-            plt.plot(g['x'], g['y'], linewidth=0.8, alpha=0.7)
+            g = groups[pid]
+            plt.plot(g['x'].to_numpy(), g['y'].to_numpy(), linewidth=0.8, alpha=0.7)
 
         plt.gca().invert_yaxis()
         plt.title(f"Sample of {len(subset_ids)} particle trajectories")
@@ -1,8 +1,8 @@
 #!/usr/bin/env python3
 """
 Link particle detections into trajectories using TrackPy.
-Input:  located_particles.csv  (from trackpy_batch_detect.py)
-Output: linked_trajectories.csv with 'particle' IDs
+Input:  located_particles.parquet  (from batch_detect_01.py)
+Output: linked_trajectories.parquet with 'particle' IDs
 """
 
 import os
@@ -10,19 +10,19 @@ import pandas as pd
 import trackpy as tp
 
 # --- Config ---
-INPUT_CSV  = "/media/ben/Extreme SSD/particles_ML/2025-10-06_19-06-08/located_particles.csv"
-OUTPUT_CSV = os.path.join(os.path.dirname(INPUT_CSV), "linked_trajectories.csv")
+INPUT_FILE  = "/media/ben/Extreme SSD/particles_ML/2025-10-06_19-06-08/located_particles.parquet"
+OUTPUT_FILE = os.path.join(os.path.dirname(INPUT_FILE), "linked_trajectories.parquet")
 SEARCH_RANGE = 10   # max displacement (px) between frames
 MEMORY = 3          # how many frames a particle can vanish and still be linked
 # ----------------
 
 def link_particles():
-    if not os.path.exists(INPUT_CSV):
-        print(f"[!] File not found: {INPUT_CSV}")
+    if not os.path.exists(INPUT_FILE):
+        print(f"[!] File not found: {INPUT_FILE}")
         return
 
-    print(f"[i] Loading detections from {INPUT_CSV}")
-    df = pd.read_csv(INPUT_CSV)
+    print(f"[i] Loading detections from {INPUT_FILE}")
+    df = pd.read_parquet(INPUT_FILE)
     if "frame_index" not in df.columns:
         print("[!] Missing 'frame_index' column. Did you run the batch detection first?")
         return
@@ -33,8 +33,8 @@ def link_particles():
     linked = tp.link_df(df, search_range=SEARCH_RANGE, memory=MEMORY)
 
     print(f"[✓] Linked {linked['particle'].nunique()} unique particles.")
-    linked.to_csv(OUTPUT_CSV, index=False)
-    print(f"[✓] Saved linked trajectories to {OUTPUT_CSV}")
+    linked.to_parquet(OUTPUT_FILE, engine="pyarrow", compression="zstd", compression_level=3, index=False)
+    print(f"[✓] Saved linked trajectories to {OUTPUT_FILE}")
 
     # Quick summary
     track_lens = linked.groupby('particle')['frame_index'].count()
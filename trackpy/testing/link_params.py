@@ -11,10 +11,11 @@ It prints:
 so you can judge which parameters keep continuity best.
 
 Usage:
-    python3 link_param_sweep.py /path/to/located_particles.csv
+    python3 link_param_sweep.py /path/to/located_particles.parquet   (or .csv)
 """
 
 import sys, os
+import multiprocessing as mp
 import pandas as pd
 import numpy as np
 import trackpy as tp
@@ -34,9 +35,17 @@ def analyze_params(df, search_range, memory):
     pct_long = (grouped >= THRESHOLD_LONG).mean() * 100
     return n_tracks, mean_len, median_len, pct_long
 
+_DF = None  # detections, set before the pool forks so workers share the pages
+
+def _init_worker():
+    tp.quiet()  # per-frame link progress from parallel workers would interleave
+
+def _sweep_one(search_range, memory):
+    return analyze_params(_DF, search_range, memory)
+
 def main():
     if len(sys.argv) < 2:
-        print("Usage: python3 link_param_sweep.py located_particles.csv")
+        print("Usage: python3 link_param_sweep.py located_particles.parquet")
         sys.exit(1)
 
     path = sys.argv[1]
@@ -45,16 +54,22 @@ def main():
         sys.exit(1)
 
     print(f"[i] Loading detections from: {path}")
-    df = pd.read_csv(path)
-    if 'frame' not in df.columns:
-        print("[!] CSV must contain 'frame' column.")
+    global _DF
+    _DF = pd.read_parquet(path) if path.endswith(".parquet") else pd.read_csv(path)
+    if 'frame' not in _DF.columns:
+        print("[!] Detections must contain 'frame' column.")
         sys.exit(1)
 
     results = []
-    print("[i] Running parameter sweep...\n")
+    combos = list(product(SEARCH_RANGES, MEMORIES))
+    print(f"[i] Running parameter sweep ({len(combos)} combinations in parallel)...\n")
+
+    # Fork after loading so every worker reads the same copy-on-write DataFrame
+    ctx = mp.get_context("fork")
+    with ctx.Pool(processes=min(len(combos), os.cpu_count() or 1), initializer=_init_worker) as pool:
+        sweep = pool.starmap(_sweep_one, combos)
 
-    for search_range, memory in product(SEARCH_RANGES, MEMORIES):
-        n_tracks, mean_len, median_len, pct_long = analyze_params(df, search_range, memory)
+    for (search_range, memory), (n_tracks, mean_len, median_len, pct_long) in zip(combos, sweep):
         results.append({
             'search_range': search_range,
             'memory': memory,